@@ -1,69 +1,369 @@
+import asyncio
 import logging
 import os
+from functools import lru_cache
+from typing import Literal, Optional
 
+import onnxruntime as ort
 from dotenv import load_dotenv
 from fastembed import SparseTextEmbedding, TextEmbedding
-from qdrant_client import QdrantClient, models
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
 
 # Load environment variables
 load_dotenv()
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_HOST = os.getenv("QDRANT_HOST")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
 collection_name = "genezio"
 
+DENSE_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+SPARSE_MODEL_NAME = "Qdrant/bm42-all-minilm-l6-v2-attentions"
+EMBEDDING_CACHE_SIZE = 1024
+# ONNX Runtime intra-op threads per embedding model; defaults to half the cores so
+# the dense and sparse models can run concurrently without oversubscribing
+EMBEDDING_THREADS = int(
+    os.getenv("EMBEDDING_THREADS", max(1, (os.cpu_count() or 1) // 2))
+)
+# Device for the embedding models: "cpu" or "cuda"
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+# Set to "1" to optimize the cached ONNX models at startup (FP16 dense model on CUDA)
+EMBEDDING_OPTIMIZE_ONNX = os.getenv("EMBEDDING_OPTIMIZE_ONNX", "0") == "1"
+# Set to "1" to build sparse query vectors from BM42 token hashes, skipping the model
+SPARSE_FAST_QUERY = os.getenv("SPARSE_FAST_QUERY", "0") == "1"
+# Sub-batch size for length-bucketed query batches
+EMBED_BATCH_SIZE = 32
+# Each prefetch arm returns more candidates than the final limit so RRF can fuse them
+PREFETCH_OVERSAMPLING = 10
+MIN_PREFETCH_LIMIT = 50
+# Only the chunk text is needed from scored points
+RESULT_PAYLOAD = models.PayloadSelectorInclude(include=["text"])
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _embedding_providers(device):
+    if device == "cuda":
+        if "CUDAExecutionProvider" in ort.get_available_providers():
+            return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+        logger.warning("CUDAExecutionProvider is not available, using CPU instead")
+    return ["CPUExecutionProvider"]
+
+
+def _reload_onnx_model(model, model_file):
+    """
+    Point a loaded fastembed model at another ONNX file in its model directory.
+    """
+    model.model_description = {**model.model_description, "model_file": model_file}
+    model.load_onnx_model()
+
+
+def _write_atomically(path, write):
+    """
+    Write a file through a process-unique temporary name in the same directory and
+    rename it into place, so concurrent processes never load a partial model.
+    """
+    tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp{path.suffix}")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _optimize_embedding_models(embedding_model, sparse_embedding_model, use_gpu):
+    """
+    Replace the downloaded ONNX models with optimized copies, written next to the
+    originals on first use. The dense model gets BERT graph fusions (and FP16 weights
+    on CUDA); the sparse model gets int8 dynamic quantization on CPU.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.transformers.optimizer import optimize_model
+
+    dense = embedding_model.model
+    dense_file = "model_fp16.onnx" if use_gpu else "model_optimized.onnx"
+    if not (dense._model_dir / dense_file).exists():
+        optimized = optimize_model(
+            str(dense._model_dir / dense.model_description["model_file"]),
+            model_type="bert",
+            opt_level=99,
+            use_gpu=use_gpu,
+        )
+        if use_gpu:
+            optimized.convert_float_to_float16(keep_io_types=True)
+        _write_atomically(
+            dense._model_dir / dense_file,
+            lambda path: optimized.save_model_to_file(str(path)),
+        )
+    _reload_onnx_model(dense, dense_file)
+
+    if not use_gpu:
+        sparse = sparse_embedding_model.model
+        sparse_file = "model_quantized.onnx"
+        if not (sparse._model_dir / sparse_file).exists():
+            _write_atomically(
+                sparse._model_dir / sparse_file,
+                lambda path: quantize_dynamic(
+                    sparse._model_dir / sparse.model_description["model_file"],
+                    path,
+                    weight_type=QuantType.QInt8,
+                ),
+            )
+        _reload_onnx_model(sparse, sparse_file)
+
+
+@lru_cache(maxsize=None)
+def _load_embedding_models(device="cpu"):
+    """
+    Load the dense and sparse embedding models once per process and device.
+    """
+    providers = _embedding_providers(device)
+    embedding_model = TextEmbedding(
+        model_name=DENSE_MODEL_NAME,
+        providers=providers,
+        threads=EMBEDDING_THREADS,
+    )
+    sparse_embedding_model = SparseTextEmbedding(
+        model_name=SPARSE_MODEL_NAME,
+        providers=providers,
+        threads=EMBEDDING_THREADS,
+    )
+    if EMBEDDING_OPTIMIZE_ONNX:
+        try:
+            _optimize_embedding_models(
+                embedding_model,
+                sparse_embedding_model,
+                use_gpu="CUDAExecutionProvider" in providers,
+            )
+        except Exception as e:
+            logger.warning(f"ONNX optimization failed, using the original models: {e}")
+    return embedding_model, sparse_embedding_model
+
+
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def _dense_embed(query: str, device="cpu") -> tuple:
+    embedding_model, _ = _load_embedding_models(device)
+    return tuple(next(iter(embedding_model.embed([query]))).tolist())
+
+
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def _sparse_embed(query: str, device="cpu", fast=False) -> tuple[tuple, tuple]:
+    _, sparse_embedding_model = _load_embedding_models(device)
+    sparse_query = _sparse_query_embeddings(sparse_embedding_model, [query], fast)[0]
+    return tuple(sparse_query.indices.tolist()), tuple(sparse_query.values.tolist())
+
+
+def embed_length_sorted(model, texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embed texts in length-sorted mini-batches so each batch is padded to a similar
+    length, then return the embeddings in the caller's order.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    embeddings = [None] * len(texts)
+    sorted_embeddings = model.embed([texts[i] for i in order], batch_size=batch_size)
+    for i, embedding in zip(order, sorted_embeddings):
+        embeddings[i] = embedding
+    return embeddings
+
+
+def _sparse_query_embeddings(sparse_embedding_model, queries, fast=False):
+    if fast:
+        # Token hashes weighted 1.0; Qdrant's IDF modifier supplies the term weights
+        return list(sparse_embedding_model.query_embed(queries))
+    return embed_length_sorted(sparse_embedding_model, queries)
+
+
+def embedding_cache_info():
+    """
+    Return hit/miss statistics for the query embedding caches.
+    """
+    return {
+        "dense": _dense_embed.cache_info()._asdict(),
+        "sparse": _sparse_embed.cache_info()._asdict(),
+    }
+
+
 class HybridSearch:
     """
     class for performing hybrid search using dense and sparse embeddings.
     """
 
-    def __init__(self) -> None:
+    def __init__(self, device: Literal["cpu", "cuda"] = EMBEDDING_DEVICE) -> None:
         """
         Initialize the Hybrid_search object with dense and sparse embedding models and a Qdrant client.
         """
-        self.embedding_model = TextEmbedding(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
-        self.sparse_embedding_model = SparseTextEmbedding(
-            model_name="Qdrant/bm42-all-minilm-l6-v2-attentions"
+        self.device = device
+        self.embedding_model, self.sparse_embedding_model = _load_embedding_models(
+            device
         )
         self.qdrant_client = QdrantClient(
-            url=QDRANT_HOST, api_key=QDRANT_API_KEY, timeout=30
+            url=QDRANT_HOST,
+            api_key=QDRANT_API_KEY,
+            timeout=30,
+            prefer_grpc=True,
+            grpc_port=QDRANT_GRPC_PORT,
         )
+        self.async_qdrant_client = AsyncQdrantClient(
+            url=QDRANT_HOST,
+            api_key=QDRANT_API_KEY,
+            timeout=30,
+            prefer_grpc=True,
+            grpc_port=QDRANT_GRPC_PORT,
+        )
+        self.sparse_fast_query = SPARSE_FAST_QUERY and self._collection_has_idf()
+
+    def _collection_has_idf(self):
+        """
+        Check that the sparse vector applies Qdrant's IDF modifier, which fast BM42
+        queries rely on for their term weights.
+        """
+        try:
+            sparse_params = self.qdrant_client.get_collection(
+                collection_name
+            ).config.params.sparse_vectors["sparse"]
+        except Exception as e:
+            logger.warning(
+                f"Could not read the sparse vector config, using BM42 query embeddings: {e}"
+            )
+            return False
+        if sparse_params.modifier != models.Modifier.IDF:
+            logger.warning(
+                "SPARSE_FAST_QUERY is set but the sparse vector has no IDF modifier, "
+                "using BM42 query embeddings"
+            )
+            return False
+        return True
+
+    @staticmethod
+    def _build_prefetch(dense_query, sparse_indices, sparse_values, limit):
+        prefetch_limit = max(limit * PREFETCH_OVERSAMPLING, MIN_PREFETCH_LIMIT)
+        return [
+            models.Prefetch(
+                query=models.SparseVector(
+                    indices=sparse_indices,
+                    values=sparse_values,
+                ),
+                using="sparse",
+                limit=prefetch_limit,
+            ),
+            models.Prefetch(
+                query=dense_query,
+                using="dense",
+                limit=prefetch_limit,
+                params=models.SearchParams(
+                    hnsw_ef=max(64, prefetch_limit),
+                    quantization=models.QuantizationSearchParams(
+                        rescore=True,
+                        oversampling=2.0,
+                    ),
+                ),
+            ),
+        ]
 
     def query_hybrid_search(self, query, metadata_filter=None, limit=5):
-        # Embed the query using the dense embedding model
-        dense_query = list(self.embedding_model.embed([query]))[0].tolist()
+        # Embed the query using the dense embedding model (cached per query string)
+        dense_query = _dense_embed(query, self.device)
 
-        # Embed the query using the sparse embedding model
-        sparse_query = list(self.sparse_embedding_model.embed([query]))[0]
+        # Embed the query using the sparse embedding model (cached per query string)
+        sparse_indices, sparse_values = _sparse_embed(
+            query, self.device, self.sparse_fast_query
+        )
 
         results = self.qdrant_client.query_points(
             collection_name=collection_name,
-            prefetch=[
-                models.Prefetch(
-                    query=models.SparseVector(
-                        indices=sparse_query.indices.tolist(),
-                        values=sparse_query.values.tolist(),
-                    ),
-                    using="sparse",
-                    limit=limit,
-                ),
-                models.Prefetch(
-                    query=dense_query,
-                    using="dense",
-                    limit=limit,
-                ),
-            ],
+            prefetch=self._build_prefetch(
+                dense_query, sparse_indices, sparse_values, limit
+            ),
             query_filter=metadata_filter,
             query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=limit,
+            with_payload=RESULT_PAYLOAD,
         )
 
         # Extract the document number, score, and text from the payload of each scored point
         documents = [point.payload["text"] for point in results.points]
 
         return documents
+
+    async def aquery_hybrid_search(self, query, metadata_filter=None, limit=5):
+        """
+        Async variant of query_hybrid_search. The dense and sparse embeddings run
+        concurrently in worker threads and Qdrant is queried without blocking.
+        """
+        loop = asyncio.get_running_loop()
+        dense_query, (sparse_indices, sparse_values) = await asyncio.gather(
+            loop.run_in_executor(None, _dense_embed, query, self.device),
+            loop.run_in_executor(
+                None, _sparse_embed, query, self.device, self.sparse_fast_query
+            ),
+        )
+
+        results = await self.async_qdrant_client.query_points(
+            collection_name=collection_name,
+            prefetch=self._build_prefetch(
+                dense_query, sparse_indices, sparse_values, limit
+            ),
+            query_filter=metadata_filter,
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=limit,
+            with_payload=RESULT_PAYLOAD,
+        )
+
+        return [point.payload["text"] for point in results.points]
+
+    def query_hybrid_search_batch(self, queries, metadata_filters=None, limits=None):
+        """
+        Run hybrid search for several queries, embedding them in one pass per model
+        and sending all searches to Qdrant in a single batch request.
+        metadata_filters and limits, when given, hold one entry per query.
+        """
+        if metadata_filters is None:
+            metadata_filters = [None] * len(queries)
+        if limits is None:
+            limits = [5] * len(queries)
+
+        dense_queries = embed_length_sorted(self.embedding_model, queries)
+        sparse_queries = _sparse_query_embeddings(
+            self.sparse_embedding_model, queries, self.sparse_fast_query
+        )
+
+        requests = [
+            models.QueryRequest(
+                prefetch=self._build_prefetch(
+                    dense_query,
+                    sparse_query.indices,
+                    sparse_query.values,
+                    limit,
+                ),
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                filter=metadata_filter,
+                limit=limit,
+                with_payload=RESULT_PAYLOAD,
+            )
+            for dense_query, sparse_query, metadata_filter, limit in zip(
+                dense_queries, sparse_queries, metadata_filters, limits
+            )
+        ]
+
+        results = self.qdrant_client.query_batch_points(
+            collection_name=collection_name, requests=requests
+        )
+
+        return [
+            [point.payload["text"] for point in result.points] for result in results
+        ]
+
+
+_SINGLETON: Optional[HybridSearch] = None
+
+
+def get_hybrid_search() -> HybridSearch:
+    """
+    Return the process-wide HybridSearch instance, creating it on first use.
+    """
+    global _SINGLETON
+    if _SINGLETON is None:
+        _SINGLETON = HybridSearch()
+    return _SINGLETON
@@ -23,8 +23,12 @@ logger = logging.getLogger(__name__)
 # Constants
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_HOST = os.getenv("QDRANT_HOST")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
 COLLECTION_NAME = "genezio"
 BATCH_SIZE = 4
+# New collections get Qdrant's IDF modifier on the sparse vector only when fast
+# BM42 queries are enabled, so the default scoring is unchanged
+SPARSE_FAST_QUERY = os.getenv("SPARSE_FAST_QUERY", "0") == "1"
 
 
 class CustomTransformation:
@@ -86,6 +90,8 @@ class QdrantIndexer:
             url=QDRANT_HOST,
             api_key=QDRANT_API_KEY,
             timeout=600,
+            prefer_grpc=True,
+            grpc_port=QDRANT_GRPC_PORT,
         )
 
     def small_embedding(self, text, model="text-embedding-3-small"):
@@ -108,12 +114,6 @@ class QdrantIndexer:
             .embedding
         )
 
-    def create_sparse_vector(self, text):
-        embeddings = list(self.sparse_embedding_model.embed([text]))[0]
-        return models.SparseVector(
-            indices=embeddings.indices.tolist(), values=embeddings.values.tolist()
-        )
-
     def setup_collection(self, sample_text):
         if not self.qdrant_client.collection_exists(collection_name=COLLECTION_NAME):
             dense_embedding = list(self.embedding_model.embed([sample_text]))[0]
@@ -127,6 +127,16 @@ class QdrantIndexer:
                     "dense": models.VectorParams(
                         size=len(dense_embedding),
                         distance=models.Distance.COSINE,
+                        on_disk=False,
+                        hnsw_config=models.HnswConfigDiff(
+                            m=16, ef_construct=128, on_disk=False
+                        ),
+                        quantization_config=models.ScalarQuantization(
+                            scalar=models.ScalarQuantizationConfig(
+                                type=models.ScalarType.INT8,
+                                always_ram=True,
+                            ),
+                        ),
                     ),
                     "colbert": models.VectorParams(
                         size=len(late_interaction_embedding[0]),
@@ -151,13 +161,19 @@ class QdrantIndexer:
                         index=models.SparseIndexParams(
                             on_disk=False,
                         ),
+                        modifier=models.Modifier.IDF if SPARSE_FAST_QUERY else None,
                     )
                 },
+                # Keep payloads on disk so RAM is left for vectors and the HNSW graph
+                on_disk_payload=True,
             )
 
     def index_documents(self, nodes):
         documents = [node.text for node in nodes]
         metadata = [node.metadata for node in nodes]
+        # Embed in length order so each batch is padded to a similar length;
+        # point ids stay the nodes' original positions
+        order = sorted(range(len(documents)), key=lambda i: len(documents[i]))
 
         total_docs = len(documents)
         processed = 0
@@ -168,12 +184,18 @@ class QdrantIndexer:
 
         while processed < total_docs:
             end_idx = min(processed + BATCH_SIZE, total_docs)
-            batch_docs = documents[processed:end_idx]
-            batch_metadata = metadata[processed:end_idx]
+            batch_ids = order[processed:end_idx]
+            batch_docs = [documents[i] for i in batch_ids]
+            batch_metadata = [metadata[i] for i in batch_ids]
 
             try:
                 dense_embeddings = list(self.embedding_model.embed(batch_docs))
-                sparse_vectors = [self.create_sparse_vector(doc) for doc in batch_docs]
+                sparse_vectors = [
+                    models.SparseVector(
+                        indices=embedding.indices, values=embedding.values
+                    )
+                    for embedding in self.sparse_embedding_model.embed(batch_docs)
+                ]
                 late_interaction_embeddings = list(
                     self.late_interaction_embedding_model.embed(batch_docs)
                 )
@@ -182,7 +204,7 @@ class QdrantIndexer:
 
                 points = [
                     models.PointStruct(
-                        id=processed + i,
+                        id=point_id,
                         vector={
                             "dense": dense_emb.tolist(),
                             "sparse": sparse_vec,
@@ -195,7 +217,8 @@ class QdrantIndexer:
                             **metadata,
                         },
                     )
-                    for i, (
+                    for (
+                        point_id,
                         doc,
                         metadata,
                         dense_emb,
@@ -203,16 +226,15 @@ class QdrantIndexer:
                         late_emb,
                         small_emb,
                         large_emb,
-                    ) in enumerate(
-                        zip(
-                            batch_docs,
-                            batch_metadata,
-                            dense_embeddings,
-                            sparse_vectors,
-                            late_interaction_embeddings,
-                            small_embeddings,
-                            large_embeddings,
-                        )
+                    ) in zip(
+                        batch_ids,
+                        batch_docs,
+                        batch_metadata,
+                        dense_embeddings,
+                        sparse_vectors,
+                        late_interaction_embeddings,
+                        small_embeddings,
+                        large_embeddings,
                     )
                 ]
 
@@ -230,8 +252,8 @@ class QdrantIndexer:
                 )
 
             except Exception as e:
-                failed_batches.append((processed, end_idx))
-                logger.error(f"Error processing batch {processed}-{end_idx}: {str(e)}")
+                failed_batches.append(batch_ids)
+                logger.error(f"Error processing nodes {batch_ids}: {str(e)}")
 
             processed = end_idx
 
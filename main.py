@@ -3,11 +3,12 @@ import os
 import tempfile
 from pathlib import Path
 
+import pandas as pd
 import streamlit as st
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 
-from hybrid_retrieval import HybridSearch
+from hybrid_retrieval import get_hybrid_search
 from indexing import DocumentProcessor, QdrantIndexer
 from search import Generate, create_query_engine
 
@@ -21,7 +22,20 @@ logger = logging.getLogger(__name__)
 # Constants
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 QDRANT_HOST = os.getenv("QDRANT_HOST")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", 6334))
 COLLECTION_NAME = "genezio"
+SCROLL_PAGE_SIZE = 512
+FILE_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+# Payload fields needed for the per-file summary; chunk text is fetched on demand
+SUMMARY_PAYLOAD_FIELDS = [
+    "file_name",
+    "file_path",
+    "file_type",
+    "file_size",
+    "creation_date",
+    "last_modified_date",
+    "page_label",
+]
 
 
 class DocumentStats:
@@ -29,65 +43,96 @@ class DocumentStats:
         self.client = QdrantClient(
             url=QDRANT_HOST,
             api_key=QDRANT_API_KEY,
+            prefer_grpc=True,
+            grpc_port=QDRANT_GRPC_PORT,
         )
-        self.hybrid_search = HybridSearch()
+        self.hybrid_search = get_hybrid_search()
+        self.prompt_generator = Generate()
+
+    def _scroll_points(self, **kwargs):
+        """Yield all matching points, following Qdrant's next-page offset"""
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=COLLECTION_NAME,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_vectors=False,
+                **kwargs,
+            )
+            yield from points
+            if offset is None:
+                break
 
     def get_indexed_documents(self):
-        try:
-            # Get all points from Qdrant
-            response = self.client.scroll(
-                collection_name=COLLECTION_NAME, limit=10000, with_payload=True
+        # Page through the summary fields of all points in Qdrant
+        payloads = pd.DataFrame(
+            [
+                point.payload
+                for point in self._scroll_points(
+                    with_payload=models.PayloadSelectorInclude(
+                        include=SUMMARY_PAYLOAD_FIELDS
+                    ),
+                )
+            ],
+            columns=SUMMARY_PAYLOAD_FIELDS,
+        )
+
+        if payloads.empty:
+            return {}
+
+        # Aggregate file metadata and page labels per file
+        files = payloads.groupby("file_name", sort=False, dropna=False)
+        documents = (
+            files[
+                [
+                    "file_path",
+                    "file_type",
+                    "file_size",
+                    "creation_date",
+                    "last_modified_date",
+                ]
+            ]
+            .first()
+            .fillna("")
+        )
+        documents["pages"] = files["page_label"].agg(
+            lambda labels: sorted(
+                set(labels.dropna()),
+                key=lambda x: int(x) if x.isdigit() else float("inf"),
             )
+        )
 
-            points = response[0]
-            documents = {}
+        return documents.to_dict("index")
 
-            for point in points:
-                payload = point.payload
-                filename = payload.get("file_name")
-
-                if filename not in documents:
-                    documents[filename] = {
-                        "pages": set(),
-                        "file_path": payload.get("file_path", ""),
-                        "file_type": payload.get("file_type", ""),
-                        "file_size": payload.get("file_size", ""),
-                        "creation_date": payload.get("creation_date", ""),
-                        "last_modified_date": payload.get("last_modified_date", ""),
-                        "text_chunks": [],
-                    }
-
-                # Add page number to set of pages
-                if "page_label" in payload:
-                    documents[filename]["pages"].add(payload["page_label"])
-
-                # Add text chunk
-                if "text" in payload:
-                    documents[filename]["text_chunks"].append(
-                        {
-                            "page": payload.get("page_label"),
-                            "text": payload["text"][:200] + "..."
-                            if len(payload["text"]) > 200
-                            else payload["text"],
-                        }
+    def get_text_chunks(self, filename):
+        # Page through the text of a single file's points in Qdrant
+        points = self._scroll_points(
+            scroll_filter=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="file_name", match=models.MatchValue(value=filename)
                     )
+                ]
+            ),
+            with_payload=models.PayloadSelectorInclude(include=["page_label", "text"]),
+        )
 
-            # Convert sets to lists for display
-            for doc in documents.values():
-                doc["pages"] = sorted(
-                    list(doc["pages"]),
-                    key=lambda x: int(x) if x.isdigit() else float("inf"),
-                )
+        chunks = pd.DataFrame(
+            [point.payload for point in points], columns=["page_label", "text"]
+        ).dropna(subset=["text"])
 
-            return documents
+        # Truncate long chunks to a 200 character preview
+        previews = chunks["text"].str.slice(0, 200)
+        chunks["text"] = previews.where(
+            chunks["text"].str.len() <= 200, previews + "..."
+        )
 
-        except Exception as e:
-            logger.error(f"Error fetching documents: {e}")
-            return {}
+        return chunks.rename(columns={"page_label": "page"}).to_dict("records")
 
     def search_documents(self, query_text, limit=5):
         try:
-            prompt = Generate().prompt_generation(query=query_text)
+            prompt = self.prompt_generator.prompt_generation(query=query_text)
             response = create_query_engine(prompt)
             return response
             # return self.hybrid_search.query_hybrid_search(query_text, limit=limit)
@@ -96,13 +141,41 @@ class DocumentStats:
             return []
 
 
+@st.cache_resource
+def get_doc_stats():
+    """Return a DocumentStats instance shared across Streamlit reruns"""
+    return DocumentStats()
+
+
+@st.cache_resource
+def get_document_processor():
+    """Return a DocumentProcessor instance shared across Streamlit reruns"""
+    return DocumentProcessor()
+
+
+@st.cache_resource
+def get_indexer():
+    """Return a QdrantIndexer instance shared across Streamlit reruns"""
+    return QdrantIndexer()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_indexed_documents() -> dict:
+    """Return the indexed documents summary; errors propagate so they are not cached"""
+    return get_doc_stats().get_indexed_documents()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_text_chunks(filename: str) -> list:
+    """Return the text previews of one file; errors propagate so they are not cached"""
+    return get_doc_stats().get_text_chunks(filename)
+
+
 def format_file_size(size_in_bytes):
     """Convert bytes to human readable format"""
-    for unit in ["B", "KB", "MB", "GB"]:
-        if size_in_bytes < 1024:
-            return f"{size_in_bytes:.2f} {unit}"
-        size_in_bytes /= 1024
-    return f"{size_in_bytes:.2f} TB"
+    # Each unit is 2**10 times the previous, so the bit length picks the unit directly
+    i = max(0, min(4, (size_in_bytes.bit_length() - 1) // 10))
+    return f"{size_in_bytes / (1 << (10 * i)):.2f} {FILE_SIZE_UNITS[i]}"
 
 
 def display_documents(documents):
@@ -132,20 +205,24 @@ def display_documents(documents):
                 st.markdown("**Storage**")
                 st.write("Path:", doc["file_path"])
 
-            # Show text chunks in a tabbed interface
-            if doc["text_chunks"]:
-                tabs = st.tabs(
-                    [f"Page {chunk['page']}" for chunk in doc["text_chunks"]]
-                )
-                for tab, chunk in zip(tabs, doc["text_chunks"]):
-                    with tab:
-                        st.text_area(
-                            "Content Preview",
-                            chunk["text"],
-                            height=150,
-                            disabled=True,
-                            key=f"{filename}_{chunk['page']}",
-                        )
+            # Show text chunks in a tabbed interface, fetched only when requested
+            if st.checkbox("Show content preview", key=f"{filename}_preview"):
+                try:
+                    text_chunks = _fetch_text_chunks(filename)
+                except Exception as e:
+                    logger.error(f"Error fetching text chunks for {filename}: {e}")
+                    text_chunks = []
+                if text_chunks:
+                    tabs = st.tabs([f"Page {chunk['page']}" for chunk in text_chunks])
+                    for tab, chunk in zip(tabs, text_chunks):
+                        with tab:
+                            st.text_area(
+                                "Content Preview",
+                                chunk["text"],
+                                height=150,
+                                disabled=True,
+                                key=f"{filename}_{chunk['page']}",
+                            )
 
 
 def display_search_results(results):
@@ -195,7 +272,7 @@ def main():
                                 f.write(uploaded_file.getvalue())
 
                         # Process documents
-                        processor = DocumentProcessor()
+                        processor = get_document_processor()
                         nodes, error = processor.process_documents(temp_dir)
 
                         if error:
@@ -205,10 +282,14 @@ def main():
                         progress_text = st.text("Indexing documents...")
 
                         # Index documents
-                        indexer = QdrantIndexer()
+                        indexer = get_indexer()
                         indexer.setup_collection(nodes[0].text)
                         success = indexer.index_documents(nodes)
 
+                        # The summary cache is shared by all sessions
+                        _fetch_indexed_documents.clear()
+                        _fetch_text_chunks.clear()
+
                         if success:
                             st.success("✅ Documents successfully indexed!")
                         else:
@@ -221,10 +302,15 @@ def main():
         col1, col2 = st.columns([1, 6])
         with col1:
             if st.button("🔄 Refresh"):
-                st.session_state.refresh_stats = True
+                _fetch_indexed_documents.clear()
+                _fetch_text_chunks.clear()
 
         # Get and display documents
-        documents = DocumentStats().get_indexed_documents()
+        try:
+            documents = _fetch_indexed_documents()
+        except Exception as e:
+            logger.error(f"Error fetching documents: {e}")
+            documents = {}
         display_documents(documents)
 
     with tab3:
@@ -238,7 +324,7 @@ def main():
             if query:
                 with st.spinner("Searching..."):
                     # Perform search
-                    doc_stats = DocumentStats()
+                    doc_stats = get_doc_stats()
                     results = doc_stats.search_documents(query, limit=num_results)
 
                     # Display results
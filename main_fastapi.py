@@ -1,20 +1,53 @@
+import logging
 import os
 import shutil
 import tempfile
+from functools import lru_cache
 from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI, File, HTTPException, UploadFile
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from qdrant_client import models
 
+from hybrid_retrieval import embedding_cache_info
 from indexing import DocumentProcessor, QdrantIndexer
 from search import Generate, create_query_engine
 
+logger = logging.getLogger(__name__)
+
+# Uploads are copied to disk in chunks of this size to keep memory bounded
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 app = FastAPI(
     title="Document Search API",
     description="API for processing, indexing and searching documents using hybrid search",
     version="1.0.0",
 )
 
+# Shared across requests so the embedding models and Qdrant client load once
+PROMPT_GENERATOR = Generate()
+
+
+def get_prompt_generator() -> Generate:
+    return PROMPT_GENERATOR
+
+
+# Built on first use (inside the threadpool) and then shared across requests
+@lru_cache(maxsize=1)
+def get_document_processor() -> DocumentProcessor:
+    return DocumentProcessor()
+
+
+@lru_cache(maxsize=1)
+def get_indexer() -> QdrantIndexer:
+    return QdrantIndexer()
+
+
+def save_upload(file: UploadFile, file_path: str) -> None:
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer, UPLOAD_CHUNK_SIZE)
+
 
 # Pydantic models
 class ProcessingResponse(BaseModel):
@@ -49,22 +82,23 @@ async def index_documents(files: List[UploadFile] = File(...)):
                     )
 
                 file_path = os.path.join(temp_dir, file.filename)
-                with open(file_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
+                await run_in_threadpool(save_upload, file, file_path)
 
-            # Process documents
-            processor = DocumentProcessor()
-            nodes, error = processor.process_documents(temp_dir)
+            # Process documents off the event loop
+            processor = await run_in_threadpool(get_document_processor)
+            nodes, error = await run_in_threadpool(
+                processor.process_documents, temp_dir
+            )
 
             if error:
                 raise HTTPException(status_code=400, detail=error)
 
             # Initialize indexer and setup collection
-            indexer = QdrantIndexer()
-            indexer.setup_collection(nodes[0].text)
+            indexer = await run_in_threadpool(get_indexer)
+            await run_in_threadpool(indexer.setup_collection, nodes[0].text)
 
-            # Index documents
-            success = indexer.index_documents(nodes)
+            # Index documents off the event loop
+            success = await run_in_threadpool(indexer.index_documents, nodes)
 
             if not success:
                 raise HTTPException(
@@ -83,14 +117,15 @@ async def index_documents(files: List[UploadFile] = File(...)):
 
 
 @app.post("/search/", response_model=SearchResponse)
-async def search_documents(query: str):
+async def search_documents(
+    query: str, prompt_gen: Generate = Depends(get_prompt_generator)
+):
     """
     Perform hybrid search on indexed documents.
     """
     try:
-        prompt_gen = Generate()
-        prompt = prompt_gen.prompt_generation(query=query)
-        response = create_query_engine(prompt)
+        prompt = await prompt_gen.aprompt_generation(query=query)
+        response = await run_in_threadpool(create_query_engine, prompt)
 
         return SearchResponse(response=response)
 
@@ -98,12 +133,49 @@ async def search_documents(query: str):
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
 
 
+@app.post("/search_batch/", response_model=List[SearchResponse])
+def search_documents_batch(
+    queries: List[SearchQuery],
+    prompt_gen: Generate = Depends(get_prompt_generator),
+):
+    """
+    Perform hybrid search for several queries in a single batch.
+
+    Declared sync so FastAPI runs the blocking retrieval and LLM calls in a threadpool.
+    """
+    try:
+        metadata_filters = [
+            (
+                models.Filter.model_validate(q.metadata_filter)
+                if q.metadata_filter
+                else None
+            )
+            for q in queries
+        ]
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid metadata_filter: {e}")
+
+    try:
+        prompts = prompt_gen.prompt_generation_batch(
+            [q.query for q in queries],
+            metadata_filters=metadata_filters,
+            limits=[q.limit for q in queries],
+        )
+
+        return [SearchResponse(response=create_query_engine(p)) for p in prompts]
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
+
+
 @app.get("/health/")
 async def health_check():
     """
-    Basic health check endpoint.
+    Basic health check endpoint, including query embedding cache statistics.
     """
-    return {"status": "healthy"}
+    cache_info = embedding_cache_info()
+    logger.info(f"Embedding cache: {cache_info}")
+    return {"status": "healthy", "embedding_cache": cache_info}
 
 
 if __name__ == "__main__":
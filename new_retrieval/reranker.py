@@ -1,10 +1,17 @@
+from functools import lru_cache
+
 from sentence_transformers import CrossEncoder
 
 
+@lru_cache(maxsize=1)
+def _load_cross_encoder():
+    # Load the CrossEncoder model once per process
+    return CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+
 class Reranking:
     def __init__(self) -> None:
-        # Load the CrossEncoder model
-        self.model = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
+        self.model = _load_cross_encoder()
 
     def rerank_documents(self, query, documents):
         # Compute the similarity scores between the query and each document
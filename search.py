@@ -1,3 +1,5 @@
+from typing import List
+
 from dotenv import load_dotenv
 from llama_index.core import PromptTemplate
 from llama_index.core.query_engine import CustomQueryEngine
@@ -5,14 +7,14 @@ from llama_index.core.response_synthesizers import BaseSynthesizer, TreeSummariz
 from llama_index.llms.openai import OpenAI
 
 # from reranker import Reranking
-from hybrid_retrieval import HybridSearch
+from hybrid_retrieval import get_hybrid_search
 
 load_dotenv()
 
 
 class Generate:
     def __init__(self) -> None:
-        self.search = HybridSearch()
+        self.search = get_hybrid_search()
         # self.reranker = Reranking()
         self.prompt_str = """You are an AI assistant specializing in answering user queries. Your task is to provide a clear, concise, and informative explanation based on the following context and query.
 
@@ -33,16 +35,36 @@ class Generate:
         """
         self.prompt_tmpl = PromptTemplate(self.prompt_str)
 
+    def _format_prompt(self, query: str, results):
+        context = "\n\n".join(results)
+
+        return self.prompt_tmpl.format(context_str=context, query_str=query)
+
     def prompt_generation(self, query: str):
         results = self.search.query_hybrid_search(query)
         # reranked_documents = self.reranker.rerank_documents(query, results)
 
-        context = "\n\n".join(results)
-
-        prompt_templ = self.prompt_tmpl.format(context_str=context, query_str=query)
+        prompt_templ = self._format_prompt(query, results)
 
         return prompt_templ
 
+    async def aprompt_generation(self, query: str):
+        results = await self.search.aquery_hybrid_search(query)
+
+        return self._format_prompt(query, results)
+
+    def prompt_generation_batch(
+        self, queries: List[str], metadata_filters=None, limits=None
+    ):
+        batch_results = self.search.query_hybrid_search_batch(
+            queries, metadata_filters=metadata_filters, limits=limits
+        )
+
+        return [
+            self._format_prompt(query, results)
+            for query, results in zip(queries, batch_results)
+        ]
+
 
 class RagQueryEngine(CustomQueryEngine):
     llm: OpenAI